@@ -1,14 +1,46 @@
+from gevent import monkey
+monkey.patch_all()
+
+import grpc.experimental.gevent as grpc_gevent
+grpc_gevent.init_gevent()
+
+import gevent
+from gevent.pool import Pool
+from gevent.queue import Queue as GreenletQueue
+
 import json
 import time
-from flask import Flask, request, jsonify
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+from functools import lru_cache
+from flask import Flask, request
 import os
 from dotenv import load_dotenv
-import requests
 from google.cloud import dialogflowcx_v3 as dialogflow
+from google.cloud.dialogflowcx_v3.services.sessions.transports import SessionsGrpcTransport
 from google.oauth2 import service_account
+import google.auth.transport.requests
 from pathlib import Path
+from typing import Optional
+import msgspec
+from cachetools import TTLCache
+from pybreaker import CircuitBreaker, CircuitBreakerError
+from google.api_core.exceptions import GoogleAPICallError
+from redis import Redis
+from rq import Queue, Retry as JobRetry
+from rq.job import Dependency
 import logging
+import grpc
+import orjson
 from google.protobuf import json_format
+from google.protobuf.struct_pb2 import Struct
+from chatwoot import (
+    CHATWOOT_POOL_SIZE,
+    send_reply_to_chatwoot,
+    add_custom_attributes_chatwoot_conversation,
+    update_chatwoot_conversation_status,
+)
 
 dotenv_path = Path('config/.env')
 load_dotenv(dotenv_path=dotenv_path)
@@ -26,87 +58,415 @@ project_id = os.environ.get('PROJECT_ID')
 location = os.environ.get('LOCATION', 'us-central1')
 agent_id = os.environ.get('AGENT_ID')
 google_application_credential = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-chatwoot_api_key = os.environ.get('CHATWOOT_API_KEY')
-chatwoot_url = os.environ.get('CHATWOOT_URL')
+redis_url = os.environ.get('REDIS_URL')
 
-# Setup Google Dialogflow CX credentials
+# Setup Google Dialogflow CX credentials. Scoped up front so the gRPC channel uses this exact
+# object and sees the tokens refreshed below
 credentials = service_account.Credentials.from_service_account_file(
-    google_application_credential
+    google_application_credential,
+    scopes=['https://www.googleapis.com/auth/cloud-platform']
 )
+CREDENTIALS_REFRESH_INTERVAL = 45 * 60
+
+
+def _refresh_credentials():
+    # Refresh the access token ahead of expiry so detect_intent never waits on OAuth
+    try:
+        credentials.refresh(google.auth.transport.requests.Request())
+    except Exception:
+        app.logger.exception("Failed to refresh Google credentials.")
+    timer = threading.Timer(CREDENTIALS_REFRESH_INTERVAL, _refresh_credentials)
+    timer.daemon = True
+    timer.start()
+
+
+_refresh_credentials()
+
+# Create Dialogflow CX client on the agent's regional endpoint, with keepalive tuned so the
+# channel survives idle periods. A single HTTP/2 connection multiplexes concurrent detect_intent calls
+if location == 'global':
+    dialogflow_host = 'dialogflow.googleapis.com:443'
+else:
+    dialogflow_host = f"{location}-dialogflow.googleapis.com:443"
+
+dialogflow_channel = SessionsGrpcTransport.create_channel(
+    host=dialogflow_host,
+    credentials=credentials,
+    options=[
+        ('grpc.max_send_message_length', -1),
+        ('grpc.max_receive_message_length', -1),
+        ('grpc.keepalive_time_ms', 30000),
+        ('grpc.keepalive_timeout_ms', 10000),
+        ('grpc.http2.max_pings_without_data', 0),
+        ('grpc.use_local_subchannel_pool', 1),
+    ]
+)
+dialogflow_client = dialogflow.SessionsClient(
+    transport=SessionsGrpcTransport(host=dialogflow_host, channel=dialogflow_channel)
+)
+
+# Connect now so the first webhook doesn't pay for DNS, TLS and the HTTP/2 handshake
+try:
+    grpc.channel_ready_future(dialogflow_channel).result(timeout=10)
+except grpc.FutureTimeoutError:
+    app.logger.warning("Dialogflow channel not ready after 10s, continuing without warmup.")
+
+# Fail fast while Dialogflow keeps failing, instead of piling up blocked requests
+_dialogflow_breaker = CircuitBreaker(fail_max=10, reset_timeout=30)
+DIALOGFLOW_TIMEOUT = 5.0
+UNAVAILABLE_MESSAGE = "Desculpe, estou com dificuldades no momento. Tente novamente em instantes."
+
+# Greenlet pool for Chatwoot calls that can run alongside each other, capped at the HTTP connection pool
+# size. When it is full, callers wait for a free slot instead of queueing work in memory
+_io_pool = Pool(CHATWOOT_POOL_SIZE)
+
+# Webhook events wait EVENT_DELAY seconds before they are processed. Locally each one holds a greenlet
+# from this pool while it waits, so the cap allows about EVENT_POOL_SIZE / EVENT_DELAY events per second
+# per worker before new webhooks wait for a free slot
+EVENT_DELAY = 6
+EVENT_POOL_SIZE = 1000
+_event_pool = Pool(EVENT_POOL_SIZE)
+
+# How long a Chatwoot message id is remembered in Redis to drop redelivered webhooks
+EVENT_DEDUPE_TTL = 600
+
+# When Redis is configured, acknowledged events are queued for `python worker.py` so they survive restarts,
+# and Chatwoot writes are handed to RQ workers (see the `worker` service in docker-compose.yml) so the
+# webhook doesn't wait on Chatwoot; otherwise both run in this process
+redis_connection = Redis.from_url(redis_url) if redis_url else None
+event_queue = Queue('events', connection=redis_connection) if redis_connection else None
+chatwoot_queue = Queue('chatwoot', connection=redis_connection) if redis_connection else None
+
+# Session parameters already converted to a Struct, per sender, reused while the contact info is unchanged
+_parameters_cache = TTLCache(maxsize=10_000, ttl=3600)
+_parameters_cache_lock = threading.Lock()
+
+# Dialogflow calls currently in flight, so duplicate webhooks wait on the first one instead of repeating it
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+# Chatwoot webhook payload, only the fields this bot reads
+class Sender(msgspec.Struct):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    phone_number: Optional[str] = None
+    email: Optional[str] = None
+
+
+class Conversation(msgspec.Struct):
+    id: Optional[int] = None
+    status: Optional[str] = None
+    custom_attributes: Optional[dict] = None
+    additional_attributes: Optional[dict] = None
+
+
+class Account(msgspec.Struct):
+    id: Optional[int] = None
+
+
+class ChatwootEvent(msgspec.Struct):
+    id: Optional[int] = None
+    message_type: Optional[str] = None
+    content: Optional[str] = None
+    conversation: Conversation = msgspec.field(default_factory=Conversation)
+    sender: Sender = msgspec.field(default_factory=Sender)
+    account: Account = msgspec.field(default_factory=Account)
+
+
+_event_decoder = msgspec.json.Decoder(ChatwootEvent)
+
+
+def _json_response(data, status=200):
+    return app.response_class(orjson.dumps(data), status=status, mimetype='application/json')
 
-# Create Dialogflow CX client
-dialogflow_client = dialogflow.SessionsClient(credentials=credentials)
 
 # Chatwoot Webhook route
 @app.route('/chatwoot-webhook', methods=['POST'])
 def chatwoot_webhook():
-    request_data = request.get_json()
-    app.logger.debug(f"Received request data: {request_data}")
+    raw_data = request.get_data(cache=False)
+    app.logger.debug("Received request data: %s", raw_data)
+
+    # Parse and validate input data
+    try:
+        event = _event_decoder.decode(raw_data)
+    except msgspec.DecodeError as e:
+        app.logger.error("Invalid request data: %s", e)
+        return _json_response({"status": "error", "message": "Invalid request data"}, 400)
 
-    # Validate input data
-    if not request_data or 'content' not in request_data:
+    if event.content is None:
         app.logger.error("Key 'content' not found in request data.")
-        return jsonify({"status": "error", "message": "Invalid request data"}), 400
+        return _json_response({"status": "error", "message": "Invalid request data"}, 400)
+
+    # Only incoming messages on conversations the bot handles go to Dialogflow
+    if not (event.message_type == 'incoming' and event.sender.id and event.conversation.status == 'pending'):
+        return _json_response({"status": "ignored"})
+
+    # Chatwoot redelivers a webhook with the same message id, only the first copy is processed by any worker
+    if redis_connection is not None and event.id is not None:
+        if not redis_connection.set(f"chatwoot:message:{event.id}", 1, nx=True, ex=EVENT_DEDUPE_TTL):
+            app.logger.info("Dropped redelivered message %s.", event.id)
+            return _json_response({"status": "duplicate"})
+
+    # Acknowledge right away so Chatwoot doesn't time out and retry, the work continues in the background
+    if event_queue is not None:
+        # Referenced by import path so the job resolves even when this file runs as __main__
+        event_queue.enqueue_in(timedelta(seconds=EVENT_DELAY), 'app.process_webhook_event', raw_data, job_timeout=60)
+    else:
+        _event_pool.spawn(_process_event_after_delay, event).link_exception(_log_event_failure)
+    return _json_response({"status": "accepted"})
+
+
+def _log_event_failure(greenlet):
+    app.logger.error("Failed to process webhook event.", exc_info=greenlet.exc_info)
 
-    # Extract relevant fields
-    message_type = request_data.get('message_type')
-    message = request_data.get('content')
-    conversation = request_data.get('conversation', {}).get('id')
-    conversation_status = request_data.get('conversation', {}).get('status')
-    sender_id = request_data.get('sender', {}).get('id')
-    account = request_data.get('account', {}).get('id')
 
-    time.sleep(6)
+def _process_event_after_delay(event):
+    time.sleep(EVENT_DELAY)
+    _process_event(event)
+
+
+def process_webhook_event(raw_data):
+    # RQ job for a queued webhook, run by worker.py. The event is handed to the greenlet pool so the worker
+    # keeps taking jobs while Dialogflow answers, and stops taking them while the pool is full
+    event = _event_decoder.decode(raw_data)
+    _event_pool.spawn(_process_event, event).link_exception(_log_event_failure)
+
+
+def _process_event(event):
+    # Extract relevant fields
+    message = event.content
+    conversation = event.conversation.id
+    sender_id = event.sender.id
+    account = event.account.id
 
     custom_attributes = {}
 
     # Verify on custom user attribute from Chatwoot if the user meta was already sent to DialogFlow
-    user_meta_sent_dialogflow = request_data.get('conversation', {}).get('custom_attributes', {}).get(
-        'user_meta_sent_dialogflow')
+    user_meta_sent_dialogflow = (event.conversation.custom_attributes or {}).get('user_meta_sent_dialogflow')
 
     contact_info = {
-        'contact_id': request_data.get('sender', {}).get('id'),
-        'contact_name': request_data.get('sender', {}).get('name'),
-        'contact_phone': request_data.get('sender', {}).get('phone_number'),
-        'email': request_data.get('sender', {}).get('email')
+        'contact_id': event.sender.id,
+        'contact_name': event.sender.name,
+        'contact_phone': event.sender.phone_number,
+        'email': event.sender.email
     }
 
     if not user_meta_sent_dialogflow:
+        parts = [message]
         if contact_info['contact_name']:
-            message += "Meu nome é " + contact_info['contact_name'] + " "
+            parts.append(f"Meu nome é {contact_info['contact_name']} ")
         # if contact_info['contact_phone']:
-        #     message += "Meu telefone é " + contact_info['contact_phone'] + " "
+        #     parts.append(f"Meu telefone é {contact_info['contact_phone']} ")
         # if contact_info['email']:
-        #     message += "Meu email é " + contact_info['email'] + " "
+        #     parts.append(f"Meu email é {contact_info['email']} ")
+        message = ''.join(parts)
 
         custom_attributes['user_meta_sent_dialogflow'] = True
-        add_custom_attributes_chatwoot_conversation(account, conversation, custom_attributes)
-
+        # Runs in parallel with the Dialogflow call below
+        _dispatch_chatwoot(add_custom_attributes_chatwoot_conversation, account, conversation, custom_attributes)
+
+    # Send message to Dialogflow CX. Replies for this conversation go through one sequence, so partial
+    # responses are posted while the stream is still open and the final reply and hand-off follow them
+    session_id = f"session_{sender_id}"
+    replies = _ChatwootSequence()
+    try:
+        _reply_to_conversation(event, session_id, message, replies)
+    finally:
+        replies.close()
+
+
+def _reply_to_conversation(event, session_id, message, replies):
+    conversation = event.conversation.id
+    account = event.account.id
+
+    def send_partial_reply(text):
+        replies.send((send_reply_to_chatwoot, account, conversation, text))
+
+    try:
+        (response_text, end_interaction, partial_replies), duplicate = _send_message_single_flight(
+            session_id, message, event, send_partial_reply
+        )
+    except (CircuitBreakerError, GoogleAPICallError, IncompleteDialogflowResponse) as e:
+        app.logger.warning("Dialogflow unavailable for conversation %s: %r", conversation, e)
+        replies.send((send_reply_to_chatwoot, account, conversation, UNAVAILABLE_MESSAGE))
+        return
 
-    if message_type == 'incoming' and sender_id and conversation_status == 'pending':
-        # Send message to Dialogflow CX
-        session_id = f"session_{sender_id}"
-        response_text, end_interaction = send_message_to_dialogflow_cx(session_id, message, request_data)
-        app.logger.debug(f"Dialogflow function response: {response_text}, {end_interaction}")
+    if duplicate:
+        # The first copy of this message is already replying to Chatwoot
+        app.logger.info("Dropped duplicate message for conversation %s.", conversation)
+        return
 
-        if not end_interaction:
-            # Send reply back to Chatwoot
-            send_reply_to_chatwoot(account, conversation, response_text)
-        # If end_interaction is true
-        else:
+    app.logger.debug("Dialogflow function response: %s, %s", response_text, end_interaction)
+
+    if not end_interaction:
+        # Send reply back to Chatwoot, unless it was already delivered as a partial response
+        if response_text not in partial_replies:
+            replies.send((send_reply_to_chatwoot, account, conversation, response_text))
+    # If end_interaction is true
+    elif chatwoot_queue is not None:
+        # Queue the summary and the status change as chained jobs, so retrying one doesn't repeat the other
+        replies.send((send_reply_to_chatwoot, account, conversation, response_text, True))
+        replies.send((update_chatwoot_conversation_status, account, conversation, 'open'))
+    else:
+        replies.send(
             # Send the execution summary as a private message on Chatwoot
-            send_reply_to_chatwoot(account, conversation, response_text, True)
+            (send_reply_to_chatwoot, account, conversation, response_text, True),
             # Set conversation status to "open" for human agent intervention
-            update_chatwoot_conversation_status(account, conversation, 'open')
+            (update_chatwoot_conversation_status, account, conversation, 'open')
+        )
+
+
+class _ChatwootSequence:
+    # Posts one conversation's Chatwoot calls in order without blocking the caller. Each send() is a step
+    # whose calls run alongside each other, and a step starts once the previous one is done, even if it
+    # failed. With Redis the steps are chained RQ jobs, otherwise a greenlet works through them.
+
+    def __init__(self):
+        self._previous_jobs = []
+        self._steps = None
+        if chatwoot_queue is None:
+            # Started up front so send() never waits for a free slot in _io_pool
+            self._steps = GreenletQueue()
+            _submit_io(self._run)
+
+    def send(self, *calls):
+        if self._steps is None:
+            self._enqueue(calls)
+        else:
+            self._steps.put(calls)
+
+    def close(self):
+        if self._steps is not None:
+            self._steps.put(None)
+
+    def _enqueue(self, calls):
+        depends_on = Dependency(jobs=self._previous_jobs, allow_failure=True) if self._previous_jobs else None
+        try:
+            self._previous_jobs = [
+                chatwoot_queue.enqueue(
+                    func, *args, depends_on=depends_on, job_timeout=30, retry=JobRetry(max=3, interval=[1, 5, 15])
+                )
+                for func, *args in calls
+            ]
+        except Exception:
+            app.logger.exception("Failed to queue Chatwoot calls.")
+
+    def _run(self):
+        for calls in iter(self._steps.get, None):
+            greenlets = [gevent.spawn(func, *args) for func, *args in calls]
+            gevent.joinall(greenlets)
+            for (func, *_), greenlet in zip(calls, greenlets):
+                if greenlet.exception is not None:
+                    _log_io_failure(greenlet, func)
+
+
+def _dispatch_chatwoot(func, *args):
+    if chatwoot_queue is not None:
+        return chatwoot_queue.enqueue(func, *args, job_timeout=30, retry=JobRetry(max=3, interval=[1, 5, 15]))
+    return _submit_io(func, *args)
+
+
+def _submit_io(func, *args):
+    greenlet = _io_pool.spawn(func, *args)
+    greenlet.link_exception(lambda g: _log_io_failure(g, func))
+    return greenlet
+
+
+def _log_io_failure(greenlet, func):
+    app.logger.error("Chatwoot call %s failed.", func.__name__, exc_info=greenlet.exc_info)
+
+
+def _send_message_single_flight(session_id, message, event, on_partial=None):
+    # Returns the Dialogflow result and whether it was shared from an identical call already in flight
+    key = (session_id, message)
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+
+    if not leader:
+        # The leader reports both its result and its failure to Chatwoot, followers only wait for it
+        try:
+            return fut.result(), True
+        except Exception:
+            return (None, False, []), True
+
+    try:
+        fut.set_result(send_message_to_dialogflow_cx(session_id, message, event, on_partial))
+    except Exception as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+    return fut.result(), False
+
+
+class IncompleteDialogflowResponse(Exception):
+    pass
+
+
+@_dialogflow_breaker
+def _detect_intent(request, on_partial=None):
+    # Stream the request so partial responses reach the user before the final one. on_partial must not
+    # block, it runs under the breaker and the Dialogflow deadline
+    stream = dialogflow_client.streaming_detect_intent(requests=iter([request]), timeout=DIALOGFLOW_TIMEOUT)
+
+    final_response = None
+    partial_texts = []
+    for streaming_response in stream:
+        streaming_response = streaming_response._pb
+        if streaming_response.WhichOneof('response') != 'detect_intent_response':
+            continue
+
+        response = streaming_response.detect_intent_response
+        if response.response_type == dialogflow.DetectIntentResponse.ResponseType.PARTIAL:
+            partial_text = _first_response_text(response.query_result)
+            if partial_text:
+                partial_texts.append(partial_text)
+                if on_partial is not None:
+                    on_partial(partial_text)
+        else:
+            final_response = response
+
+    if final_response is None:
+        raise IncompleteDialogflowResponse("Dialogflow stream ended without a final response.")
+    return final_response, partial_texts
+
+
+def _first_response_text(query_result):
+    for response_message in query_result.response_messages:
+        if response_message.text.text:
+            return response_message.text.text[0]
+    return None
+
+
+def _parameters_struct(sender_id, parameters_json):
+    fingerprint = orjson.dumps(parameters_json, option=orjson.OPT_SORT_KEYS)
+    with _parameters_cache_lock:
+        cached = _parameters_cache.get(sender_id)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    parameters = Struct()
+    parameters.update(parameters_json)
+    with _parameters_cache_lock:
+        _parameters_cache[sender_id] = (fingerprint, parameters)
+    return parameters
+
 
-    return jsonify({"status": "success"}), 200
+@lru_cache(maxsize=4096)
+def _session_path(session_id):
+    return dialogflow_client.session_path(project_id, location, agent_id, session_id)
 
 
-def send_message_to_dialogflow_cx(session_id, message, request_data=None):
-    if request_data is None:
-        request_data = []
+def send_message_to_dialogflow_cx(session_id, message, event=None, on_partial=None):
+    if event is None:
+        event = ChatwootEvent()
 
-    session_path = dialogflow_client.session_path(project_id, location, agent_id, session_id)
+    session_path = _session_path(session_id)
     language_code = 'pt-br'
 
     # Prepare the text input for Dialogflow
@@ -114,16 +474,16 @@ def send_message_to_dialogflow_cx(session_id, message, request_data=None):
     query_input = dialogflow.QueryInput(text=text_input, language_code=language_code)
 
     parameters_json = {
-            # "content": request_data.get('content'),
+            # "content": event.content,
             "contact_info": {
-                "contact_id": request_data.get('sender', {}).get('id'),
-                "contact_name": request_data.get('sender', {}).get('name'),
-                "contact_phone": request_data.get('sender', {}).get('phone_number'),
-                "email": request_data.get('sender', {}).get('email')
+                "contact_id": event.sender.id,
+                "contact_name": event.sender.name,
+                "contact_phone": event.sender.phone_number,
+                "email": event.sender.email
             },
-            "browser_info": request_data.get('conversation', {}).get('additional_attributes', {}).get('browser',
-                                                                                                      {}),
+            "browser_info": (event.conversation.additional_attributes or {}).get('browser', {}),
     }
+    parameters = _parameters_struct(event.sender.id, parameters_json)
 
     # Prepare the query parameters
     query_parameters = dialogflow.QueryParameters(
@@ -133,98 +493,56 @@ def send_message_to_dialogflow_cx(session_id, message, request_data=None):
         #     latitude=request_data.get('additional_attributes', {}).get('latitude', 0.0),
         #     longitude=request_data.get('additional_attributes', {}).get('longitude', 0.0)
         # ),
-        end_user_metadata=parameters_json,
+        end_user_metadata=parameters,
         analyze_query_text_sentiment=True,
-        parameters=parameters_json
+        parameters=parameters
     )
 
-    request = dialogflow.DetectIntentRequest(
+    request = dialogflow.StreamingDetectIntentRequest(
         session=session_path,
         query_input=query_input,
-        query_params=query_parameters
+        query_params=query_parameters,
+        enable_partial_response=True
     )
     # Make the request to Dialogflow CX
-    response = dialogflow_client.detect_intent(
-        request=request
-    )
+    response, partial_texts = _detect_intent(request, on_partial)
+
+    # Only materialize the full response when someone will read it
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("Dialogflow response: %s", orjson.dumps(json_format.MessageToDict(response)).decode())
 
-    # Convert response to a dictionary
-    response_dict = json_format.MessageToDict(response._pb)
+    # Read the fields we need straight from the protobuf message
+    query_result = response.query_result
+    response_messages = query_result.response_messages
+    first_message = response_messages[0] if response_messages else None
 
     # Default values
     end_interaction = False
     fulfillment_text = "Desculpe, não entendi."
 
     # Check if `parameters` and `fields` are present before accessing
-    if 'parameters' in response_dict['queryResult'] and 'execution_summary' in response_dict['queryResult']['parameters']:
-        fulfillment_text = response_dict['queryResult']['parameters'].get("execution_summary")
+    if 'execution_summary' in query_result.parameters.fields:
+        fulfillment_text = query_result.parameters.fields['execution_summary'].string_value
 
     # Handle response messages
-    if 'responseMessages' in response_dict['queryResult']:
-        first_message = response_dict['queryResult']['responseMessages'][0]
-
+    if first_message is not None:
         # Check if the text field exists and contains text
-        if 'text' in first_message and 'text' in first_message['text']:
-            response_text = first_message['text']['text'][0]
+        if first_message.text.text:
+            response_text = first_message.text.text[0]
         else:
             response_text = fulfillment_text
 
         # Check if end_interaction is specified
-        if 'endInteraction' in first_message:
+        if first_message.HasField('end_interaction'):
             end_interaction = True
     else:
         response_text = fulfillment_text
 
-    return response_text, end_interaction
-
-def send_reply_to_chatwoot(account, conversation, response_message, private=False):
-    private = bool(private)
-
-    url = f"{chatwoot_url}/api/v1/accounts/{account}/conversations/{conversation}/messages"
-    headers = {
-        'Content-Type': 'application/json',
-        'api_access_token': f'{chatwoot_api_key}'
-    }
-    payload = {
-        "content": response_message,
-        "message_type": "outgoing",
-        "private": private,
-    }
-
-    response = requests.post(url, headers=headers, json=payload)
-    return response.text
-
-def add_custom_attributes_chatwoot_conversation(account, conversation, custom_attributes):
-    valid_attributes = {key: value for key, value in custom_attributes.items() if value}
-
-    if not valid_attributes:
-        return
-
-    url = f"{chatwoot_url}/api/v1/accounts/{account}/conversations/{conversation}/custom_attributes"
-    headers = {
-        'Content-Type': 'application/json',
-        'api_access_token': chatwoot_api_key
-    }
-
-    payload = { "custom_attributes": valid_attributes }
-
-    response = requests.post(url, headers=headers, json=valid_attributes)
-    app.logger.info(f"Added custom attributes to Chatwoot for conversation {conversation}.")
-    return response.text
-
-def update_chatwoot_conversation_status(account, conversation, status):
-    url = f"{chatwoot_url}/api/v1/accounts/{account}/conversations/{conversation}/toggle_status"
-    headers = {
-        'Content-Type': 'application/json',
-        'api_access_token': f'{chatwoot_api_key}'
-    }
-    payload = {
-        "status": status
-    }
+    return response_text, end_interaction, partial_texts
 
-    response = requests.post(url, headers=headers, json=payload)
-    app.logger.info(f"Updated Chatwoot conversation status to '{status}' for conversation {conversation}.")
-    return response.text
 
+# For production run through gunicorn instead:
+#   gunicorn -k gevent -w 4 --worker-connections 1000 -b 0.0.0.0:5000 app:app
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    from gevent.pywsgi import WSGIServer
+    WSGIServer(('0.0.0.0', 5000), app).serve_forever()
@@ -0,0 +1,93 @@
+import os
+import logging
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+from pybreaker import CircuitBreaker
+
+# Chatwoot API helpers. Kept apart from app.py so the RQ worker can import them
+# without setting up gevent, Google credentials or the Dialogflow channel.
+
+dotenv_path = Path('config/.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+logger = logging.getLogger(__name__)
+
+chatwoot_api_key = os.environ.get('CHATWOOT_API_KEY')
+chatwoot_url = os.environ.get('CHATWOOT_URL')
+
+chatwoot_accounts_url = f"{chatwoot_url}/api/v1/accounts"
+
+# Shared HTTP session for Chatwoot, keeps connections alive between webhook events.
+# Under gevent every blocking call here yields, so one worker multiplexes many in-flight posts
+# and the pool size, not the thread count, bounds concurrency.
+# Only connection failures are retried here: the POST never reached Chatwoot, so it can't be posted twice.
+# Failed responses are retried by RQ instead.
+CHATWOOT_POOL_SIZE = 128
+_chatwoot_session = requests.Session()
+_chatwoot_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=CHATWOOT_POOL_SIZE,
+    pool_block=True,
+    max_retries=Retry(total=2, read=0, backoff_factor=0.2)
+)
+_chatwoot_session.mount('http://', _chatwoot_adapter)
+_chatwoot_session.mount('https://', _chatwoot_adapter)
+_chatwoot_session.headers.update({
+    'Content-Type': 'application/json',
+    'api_access_token': chatwoot_api_key
+})
+
+# Fail fast while Chatwoot keeps failing, instead of piling up blocked requests
+_chatwoot_breaker = CircuitBreaker(fail_max=10, reset_timeout=30)
+CHATWOOT_TIMEOUT = (3, 10)
+
+
+@_chatwoot_breaker
+def _post_to_chatwoot(url, payload):
+    response = _chatwoot_session.post(url, json=payload, timeout=CHATWOOT_TIMEOUT)
+    # Count throttling and server errors as failures, both for the breaker and for RQ retries
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
+
+def send_reply_to_chatwoot(account, conversation, response_message, private=False):
+    private = bool(private)
+
+    url = f"{chatwoot_accounts_url}/{account}/conversations/{conversation}/messages"
+    payload = {
+        "content": response_message,
+        "message_type": "outgoing",
+        "private": private,
+    }
+
+    response = _post_to_chatwoot(url, payload)
+    return response.text
+
+
+def add_custom_attributes_chatwoot_conversation(account, conversation, custom_attributes):
+    valid_attributes = {key: value for key, value in custom_attributes.items() if value}
+
+    if not valid_attributes:
+        return
+
+    url = f"{chatwoot_accounts_url}/{account}/conversations/{conversation}/custom_attributes"
+
+    response = _post_to_chatwoot(url, valid_attributes)
+    logger.info("Added custom attributes to Chatwoot for conversation %s.", conversation)
+    return response.text
+
+
+def update_chatwoot_conversation_status(account, conversation, status):
+    url = f"{chatwoot_accounts_url}/{account}/conversations/{conversation}/toggle_status"
+    payload = {
+        "status": status
+    }
+
+    response = _post_to_chatwoot(url, payload)
+    logger.info("Updated Chatwoot conversation status to '%s' for conversation %s.", status, conversation)
+    return response.text
+
@@ -0,0 +1,11 @@
+# Worker for webhook events queued when REDIS_URL is set: python worker.py
+# Jobs run in this process (SimpleWorker) so the Dialogflow client, channel and credentials are set up
+# once at import, instead of in a forked work horse per job. Each job only hands its event to the
+# greenlet pool in app.py, so many events are processed at once.
+from app import event_queue, redis_connection, _event_pool
+from rq import SimpleWorker
+
+if __name__ == '__main__':
+    SimpleWorker([event_queue], connection=redis_connection).work(with_scheduler=True)
+    # Let events already handed to the pool finish before exiting
+    _event_pool.join()